@@ -1,18 +1,27 @@
 import os
+import time
 from typing import Dict, List, Optional
 
+from anyio import CapacityLimiter, to_thread
 from dotenv import load_dotenv, find_dotenv
 from elasticsearch import Elasticsearch
-from fastapi import Body, FastAPI, UploadFile, File, HTTPException
+from fastapi import Body, FastAPI, UploadFile, File, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 import numpy as np
 import uuid
 from elasticsearch.exceptions import NotFoundError
 
 # Update imports to use full package path
+from services.common.scheduler import (
+    BULK,
+    INTERACTIVE,
+    SchedulerRejected,
+    get_scheduler,
+    tenant_key,
+)
 from services.common.vertex import (
-    call_vertex_embeddings,
-    call_vertex_text_generation,
+    scheduled_vertex_embeddings,
+    scheduled_vertex_text_generation,
 )
 from services.ingest.ingest_index import index_document
 from services.common.health import run_readiness_checks, is_system_ready
@@ -45,19 +54,21 @@ else:
     es = Elasticsearch(ELASTIC_URL, basic_auth=(ELASTIC_USER or "", ELASTIC_PASS or ""))
 
 
-def embed_query(query: str) -> List[float]:
-    embeddings = call_vertex_embeddings(
+def embed_query(query: str, tenant: Optional[str] = None) -> List[float]:
+    embeddings = scheduled_vertex_embeddings(
         project=os.environ.get("VERTEX_PROJECT", ""),
         location=os.environ.get("VERTEX_LOCATION", "us-central1"),
         model=os.environ.get("VERTEX_EMBEDDING_MODEL", ""),
         texts=[query],
+        tenant=tenant,
+        lane=INTERACTIVE,
     )
     if not embeddings:
         return []
     return embeddings[0]
 
 
-def hybrid_search(query: str, top_k: int = 5, alpha: float = 0.5):
+def hybrid_search(query: str, top_k: int = 5, alpha: float = 0.5, tenant: Optional[str] = None):
     """
     Hybrid search approach:
     - BM25 (text) and vector similarity (cosine) combined via should clauses & script_score
@@ -65,7 +76,7 @@ def hybrid_search(query: str, top_k: int = 5, alpha: float = 0.5):
     """
     if not es.indices.exists(index=INDEX_NAME):
         return []
-    query_vector = embed_query(query)  # list of floats
+    query_vector = embed_query(query, tenant=tenant)  # list of floats
 
     text_query = {
         "bool": {
@@ -116,7 +127,7 @@ def hybrid_search(query: str, top_k: int = 5, alpha: float = 0.5):
     return hits
 
 
-def call_vertex_rag(prompt: str, contexts: List[Dict]) -> str:
+def call_vertex_rag(prompt: str, contexts: List[Dict], tenant: Optional[str] = None) -> str:
     """
     Build final RAG prompt and call Vertex Text Generation (Gemini/Text Gen).
     contexts: list of retrieved text snippets + metadata.
@@ -147,16 +158,69 @@ def call_vertex_rag(prompt: str, contexts: List[Dict]) -> str:
     if not model:
         raise RuntimeError("VERTEX_TEXT_MODEL environment variable not set")
 
-    return call_vertex_text_generation(
+    return scheduled_vertex_text_generation(
         project=project,
         location=location,
         model=model,
         prompt=final_prompt,
+        tenant=tenant,
+        lane=INTERACTIVE,
+    )
+
+
+def _too_many_requests(exc: SchedulerRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=str(exc),
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
     )
 
 
+# One thread pool per scheduler lane, separate from the default pool used by
+# the sync handlers, so requests parked in the scheduler cannot starve others.
+_lane_limiters: Dict[str, CapacityLimiter] = {}
+
+
+async def _run_in_lane(lane: str, tenant: str, fn, **kwargs):
+    """Run ``fn(tenant=tenant, **kwargs)`` on one of the lane's worker threads."""
+    scheduler = get_scheduler()
+    limiter = _lane_limiters.get(lane)
+    if limiter is None:
+        limiter = _lane_limiters[lane] = CapacityLimiter(scheduler.workers[lane])
+
+    queued_at = scheduler.enter_lane(lane, tenant)
+    started = False
+
+    def run():
+        nonlocal started
+        started = True
+        scheduler.worker_started(lane, time.monotonic() - queued_at)
+        return fn(tenant=tenant, **kwargs)
+
+    try:
+        return await to_thread.run_sync(run, limiter=limiter)
+    finally:
+        scheduler.leave_lane(lane, tenant, started)
+
+
+def _request_tenant(request: Request, api_key: Optional[str]) -> str:
+    return tenant_key(api_key=api_key, client_host=request.client.host if request.client else None)
+
+
+def _answer_query(user_query: str, top_k: int, alpha: float, tenant: str) -> Dict:
+    # 1) hybrid retrieve
+    hits = hybrid_search(user_query, top_k=top_k, alpha=alpha, tenant=tenant)
+    # 2) call generator
+    answer = call_vertex_rag(user_query, hits, tenant=tenant)
+    return {"answer": answer, "sources": hits}
+
+
 @app.post("/query")
-async def query_endpoint(q: Dict = Body(...)):  # Made async
+async def query_endpoint(
+    request: Request,
+    q: Dict = Body(...),
+    x_api_key: Optional[str] = Header(None),
+):
     user_query = q.get("query")
     top_k = q.get("top_k", 5)
     alpha = q.get("alpha", 0.5)
@@ -164,15 +228,26 @@ async def query_endpoint(q: Dict = Body(...)):  # Made async
     if not user_query:
         raise HTTPException(status_code=400, detail="Query is required")
 
-    # 1) hybrid retrieve
-    hits = hybrid_search(user_query, top_k=top_k, alpha=alpha)
-    # 2) call generator
-    answer = call_vertex_rag(user_query, hits)
-    return {"answer": answer, "sources": hits}
+    try:
+        return await _run_in_lane(
+            INTERACTIVE,
+            _request_tenant(request, x_api_key),
+            _answer_query,
+            user_query=user_query,
+            top_k=top_k,
+            alpha=alpha,
+        )
+    except SchedulerRejected as exc:
+        raise _too_many_requests(exc) from exc
 
 
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...), title: Optional[str] = None):
+async def upload_document(
+    request: Request,
+    file: UploadFile = File(...),
+    title: Optional[str] = None,
+    x_api_key: Optional[str] = Header(None),
+):
     if file.content_type not in [
         "application/pdf",
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
@@ -193,7 +268,10 @@ async def upload_document(file: UploadFile = File(...), title: Optional[str] = N
         buffer.write(await file.read())
 
     try:
-        index_document(
+        await _run_in_lane(
+            BULK,
+            _request_tenant(request, x_api_key),
+            index_document,
             file_path=file_path,
             title=title or file.filename,
             metadata={"source": "upload", "original_filename": file.filename},
@@ -205,6 +283,10 @@ async def upload_document(file: UploadFile = File(...), title: Optional[str] = N
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except SchedulerRejected as exc:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise _too_many_requests(exc) from exc
 
     return {"status": "success", "file": file.filename}
 
@@ -216,6 +298,11 @@ def health_check():
     return {"status": status, "checks": checks}
 
 
+@app.get("/metrics/scheduler")
+def scheduler_metrics():
+    return get_scheduler().metrics()
+
+
 @app.get("/readyz")
 def readiness_check():
     ready = is_system_ready()
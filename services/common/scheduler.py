@@ -0,0 +1,520 @@
+"""Admission control, rate limiting and request coalescing for Vertex AI calls.
+
+Every upstream Vertex call goes through a single process-wide scheduler which:
+
+- limits each tenant and each model with a token bucket, charged per
+  embedding instance (or per generation call),
+- admits work from two priority lanes, ``interactive`` (queries) ahead of
+  ``bulk`` (ingest), keeping some capacity reserved for interactive work,
+- shares one upstream call between identical requests that are in flight at
+  the same time,
+- tracks queue depth and wait-time metrics per lane.
+
+Callers block in :meth:`VertexScheduler.submit` until admitted, so each lane
+should be driven from its own bounded worker pool (see ``workers``); the API
+layer does this so queued ingest can never use up the threads queries need.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Lanes in priority order: earlier lanes are always considered first.
+LANES = (INTERACTIVE, BULK)
+
+# Tenant for in-process callers (e.g. the ingest CLI) that have no client to attribute.
+DEFAULT_TENANT = "internal"
+
+# Upper bound on how long a waiting caller sleeps before re-checking admission.
+_POLL_INTERVAL = 0.5
+# Tenants derived from client addresses are unbounded, so keep the bucket table bounded.
+_MAX_TENANT_BUCKETS = 1024
+_WAIT_SAMPLES = 1024
+
+
+class SchedulerRejected(RuntimeError):
+    """Raised when a request is refused (queue full) or waits too long for capacity."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second.
+
+    A non-positive ``rate`` disables limiting. Requests costing more than the
+    bucket can hold are admitted once it is full and leave it in debt. Not
+    thread-safe on its own; the scheduler guards all buckets with its lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float, cost: float = 1.0, reserve: float = 0.0, pending: float = 0.0) -> float:
+        """Seconds until ``cost`` tokens can be taken while leaving ``reserve`` tokens behind.
+
+        ``pending`` tokens are owed to earlier requests and are consumed first.
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        reserve = min(reserve, self.capacity - 1.0)
+        needed = pending + min(cost, self.capacity - reserve) + reserve
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, cost: float = 1.0) -> None:
+        if self.rate > 0:
+            self.tokens -= cost
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Ticket:
+    __slots__ = (
+        "key", "lane", "tenant", "model", "cost", "enqueued_at", "deadline", "admitted", "future",
+    )
+
+    def __init__(self, key: str, lane: str, tenant: str, model: str, cost: float, max_wait: float):
+        self.key = key
+        self.lane = lane
+        self.tenant = tenant
+        self.model = model
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + max_wait
+        self.admitted = False
+        self.future: Future = Future()
+
+
+class _WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        samples = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "max": self.max,
+        }
+
+
+class _LaneMetrics:
+    def __init__(self):
+        self.rejected = 0
+        self.coalesced = 0
+        # Callers registered through ``enter_lane`` that have no worker yet, and
+        # workers currently busy with a caller.
+        self.backlog = 0
+        self.busy = 0
+        self.admission_wait = _WaitStats()
+        self.worker_wait = _WaitStats()
+
+    def snapshot(self, queued: int) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.backlog + queued,
+            "waiting_for_worker": self.backlog,
+            "waiting_for_admission": queued,
+            "admitted": self.admission_wait.count,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "wait_seconds": self.admission_wait.snapshot(),
+            "worker_wait_seconds": self.worker_wait.snapshot(),
+        }
+
+
+class VertexScheduler:
+    """Gatekeeper for upstream Vertex calls; see the module docstring."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        interactive_reserved: int = 2,
+        tenant_rate: float = 10.0,
+        tenant_burst: float = 32.0,
+        model_rate: float = 50.0,
+        model_burst: float = 100.0,
+        queue_limits: Optional[Dict[str, int]] = None,
+        max_wait: Optional[Dict[str, float]] = None,
+        workers: Optional[Dict[str, int]] = None,
+        tenant_queue_limit: int = 8,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_concurrency - 1)
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.model_rate = model_rate
+        self.model_burst = model_burst
+        self.workers = {INTERACTIVE: 32, BULK: 4, **(workers or {})}
+        self.queue_limits = {INTERACTIVE: 100, BULK: 1000, **(queue_limits or {})}
+        self.max_wait = {INTERACTIVE: 30.0, BULK: 300.0, **(max_wait or {})}
+        self.tenant_queue_limit = max(1, tenant_queue_limit)
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Ticket]] = {lane: deque() for lane in LANES}
+        # Queued tickets are only shared within a tenant, so a follower never waits
+        # on another tenant's bucket; admitted calls are shared with everyone.
+        self._queued: Dict[Tuple[str, str], _Ticket] = {}
+        self._running_calls: Dict[str, _Ticket] = {}
+        self._running = 0
+        self._outstanding: Dict[Tuple[str, str], int] = {}
+        self._tenant_buckets: Dict[str, TokenBucket] = {}
+        self._model_buckets: Dict[str, TokenBucket] = {}
+        self._metrics = {lane: _LaneMetrics() for lane in LANES}
+
+    def submit(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        tenant: Optional[str] = None,
+        model: str = "",
+        lane: str = INTERACTIVE,
+        cost: float = 1.0,
+    ) -> Any:
+        """Run ``fn`` once admitted, or share the result of an in-flight call with the same key."""
+        if lane not in self._queues:
+            raise ValueError(f"Unknown scheduler lane: {lane}")
+        tenant = tenant or DEFAULT_TENANT
+
+        with self._cond:
+            ticket = self._running_calls.get(key) or self._queued.get((key, tenant))
+            if ticket is not None:
+                if (
+                    not ticket.admitted
+                    and LANES.index(lane) < LANES.index(ticket.lane)
+                    and len(self._queues[lane]) < self._lane_capacity(lane)
+                ):
+                    # Don't leave an interactive caller stuck behind the bulk queue.
+                    # The ticket keeps its own deadline; ``_follow`` enforces ours.
+                    self._queues[ticket.lane].remove(ticket)
+                    self._queues[lane].append(ticket)
+                    ticket.lane = lane
+                    self._cond.notify_all()
+                self._metrics[lane].coalesced += 1
+                leader = False
+            else:
+                ticket = _Ticket(key, lane, tenant, model, cost, self.max_wait[lane])
+                self._check_enqueue(ticket)
+                self._queues[lane].append(ticket)
+                self._queued[(key, tenant)] = ticket
+                leader = True
+
+        if not leader:
+            self._follow(ticket, lane)
+            return ticket.future.result()
+
+        try:
+            shared = self._admit(ticket)
+        except SchedulerRejected as exc:
+            with self._cond:
+                ticket.future.set_exception(exc)
+                self._cond.notify_all()
+            raise
+
+        if shared is not None:
+            # Another tenant's identical call was admitted first; reuse its result.
+            try:
+                result = shared.future.result()
+            except BaseException as exc:
+                ticket.future.set_exception(exc)
+                raise
+            ticket.future.set_result(result)
+            return result
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            ticket.future.set_exception(exc)
+            raise
+        else:
+            ticket.future.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._running_calls.pop(key, None)
+                self._cond.notify_all()
+
+    def _lane_capacity(self, lane: str) -> int:
+        # Each worker holds at most one queued ticket; ``queue_limits`` bounds the
+        # callers waiting for a worker (see ``enter_lane``).
+        return min(self.queue_limits[lane], self.workers[lane])
+
+    def _reject(self, lane: str, message: str, retry_after: float) -> SchedulerRejected:
+        self._metrics[lane].rejected += 1
+        return SchedulerRejected(message, retry_after=max(retry_after, _POLL_INTERVAL * 2))
+
+    def _check_enqueue(self, ticket: _Ticket) -> None:
+        """Refuse a new ticket up front when it could not be admitted in time."""
+        queue = self._queues[ticket.lane]
+        if len(queue) >= self._lane_capacity(ticket.lane):
+            raise self._reject(ticket.lane, f"Vertex {ticket.lane} queue is full", 0.0)
+        if sum(1 for t in queue if t.tenant == ticket.tenant) >= self.tenant_queue_limit:
+            raise self._reject(ticket.lane, f"Too many queued Vertex {ticket.lane} requests for this client", 0.0)
+
+        now = time.monotonic()
+        pending = sum(t.cost for q in self._queues.values() for t in q if t.tenant == ticket.tenant)
+        reserve = self._reserve(ticket.lane)
+        delay = max(
+            self._tenant_bucket(ticket.tenant).delay(now, ticket.cost, reserve=reserve, pending=pending),
+            self._model_bucket(ticket.model).delay(now, ticket.cost, reserve=reserve),
+        )
+        if now + delay > ticket.deadline:
+            raise self._reject(ticket.lane, "Vertex rate limit exceeded for this client", delay)
+
+    def _dequeue(self, ticket: _Ticket) -> None:
+        self._queues[ticket.lane].remove(ticket)
+        if self._queued.get((ticket.key, ticket.tenant)) is ticket:
+            del self._queued[(ticket.key, ticket.tenant)]
+
+    def _follow(self, ticket: _Ticket, lane: str) -> None:
+        """Wait, within the follower's own lane deadline, for a shared ticket to be admitted."""
+        deadline = time.monotonic() + self.max_wait[lane]
+        with self._cond:
+            while not ticket.admitted and not ticket.future.done():
+                now = time.monotonic()
+                if now >= deadline:
+                    raise self._reject(
+                        lane,
+                        f"Timed out after {self.max_wait[lane]:.1f}s waiting for Vertex capacity",
+                        self._ticket_delay(ticket, now),
+                    )
+                self._cond.wait(timeout=min(deadline - now, _POLL_INTERVAL))
+
+    def _admit(self, ticket: _Ticket) -> Optional[_Ticket]:
+        """Block until ``ticket`` may run; return a running ticket to share instead, if any."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                running = self._running_calls.get(ticket.key)
+                if running is not None:
+                    self._dequeue(ticket)
+                    ticket.admitted = True
+                    self._metrics[ticket.lane].coalesced += 1
+                    self._cond.notify_all()
+                    return running
+
+                chosen, delay = self._next_admissible(now)
+                if chosen is ticket:
+                    self._dequeue(ticket)
+                    self._tenant_bucket(ticket.tenant).take(ticket.cost)
+                    self._model_bucket(ticket.model).take(ticket.cost)
+                    ticket.admitted = True
+                    self._running += 1
+                    self._running_calls[ticket.key] = ticket
+                    self._metrics[ticket.lane].admission_wait.record(now - ticket.enqueued_at)
+                    self._cond.notify_all()
+                    return None
+
+                # Give up as soon as our own buckets cannot refill before the deadline.
+                own_delay = self._ticket_delay(ticket, now)
+                if now + own_delay > ticket.deadline or now >= ticket.deadline:
+                    self._dequeue(ticket)
+                    self._cond.notify_all()
+                    if now >= ticket.deadline:
+                        message = f"Timed out after {now - ticket.enqueued_at:.1f}s waiting for Vertex capacity"
+                    else:
+                        message = "Vertex rate limit exceeded for this client"
+                    raise self._reject(ticket.lane, message, own_delay)
+
+                timeout = ticket.deadline - now
+                if delay:
+                    timeout = min(timeout, delay)
+                self._cond.wait(timeout=min(timeout, _POLL_INTERVAL))
+
+    def _reserve(self, lane: str) -> int:
+        return 0 if lane == INTERACTIVE else self.interactive_reserved
+
+    def _ticket_delay(self, ticket: _Ticket, now: float) -> float:
+        """Seconds until the ticket's own tenant and model buckets can cover its cost."""
+        reserve = self._reserve(ticket.lane)
+        return max(
+            self._tenant_bucket(ticket.tenant).delay(now, ticket.cost, reserve=reserve),
+            self._model_bucket(ticket.model).delay(now, ticket.cost, reserve=reserve),
+        )
+
+    def _next_admissible(self, now: float):
+        """Return the first queued ticket that may start now, plus the shortest bucket delay seen."""
+        shortest: Optional[float] = None
+        for lane in LANES:
+            if self._running >= self.max_concurrency - self._reserve(lane):
+                continue
+            for ticket in self._queues[lane]:
+                delay = self._ticket_delay(ticket, now)
+                if delay == 0:
+                    return ticket, 0.0
+                shortest = delay if shortest is None else min(shortest, delay)
+        return None, shortest
+
+    def _tenant_bucket(self, tenant: str) -> TokenBucket:
+        bucket = self._tenant_buckets.get(tenant)
+        if bucket is None:
+            if len(self._tenant_buckets) >= _MAX_TENANT_BUCKETS:
+                # A full bucket behaves exactly like a fresh one, so it is safe to drop.
+                now = time.monotonic()
+                queued = {t.tenant for queue in self._queues.values() for t in queue}
+                for name in [n for n, b in self._tenant_buckets.items() if n not in queued and b.is_full(now)]:
+                    del self._tenant_buckets[name]
+            bucket = self._tenant_buckets[tenant] = TokenBucket(self.tenant_rate, self.tenant_burst)
+        return bucket
+
+    def _model_bucket(self, model: str) -> TokenBucket:
+        bucket = self._model_buckets.get(model)
+        if bucket is None:
+            bucket = self._model_buckets[model] = TokenBucket(self.model_rate, self.model_burst)
+        return bucket
+
+    def enter_lane(self, lane: str, tenant: str) -> float:
+        """Register a caller about to wait for one of the lane's workers.
+
+        Rejects the caller when the lane backlog is full or the tenant already has
+        ``tenant_queue_limit`` requests in the lane. Returns the time waiting began.
+        """
+        with self._cond:
+            metrics = self._metrics[lane]
+            waiting = metrics.backlog - max(0, self.workers[lane] - metrics.busy)
+            if waiting >= self.queue_limits[lane]:
+                raise self._reject(lane, f"Vertex {lane} queue is full", 0.0)
+            if self._outstanding.get((lane, tenant), 0) >= self.tenant_queue_limit:
+                raise self._reject(lane, f"Too many concurrent {lane} requests for this client", 0.0)
+            self._outstanding[(lane, tenant)] = self._outstanding.get((lane, tenant), 0) + 1
+            metrics.backlog += 1
+        return time.monotonic()
+
+    def worker_started(self, lane: str, waited: float) -> None:
+        """Record that a caller registered with ``enter_lane`` got a worker."""
+        with self._cond:
+            metrics = self._metrics[lane]
+            metrics.backlog -= 1
+            metrics.busy += 1
+            metrics.worker_wait.record(waited)
+
+    def leave_lane(self, lane: str, tenant: str, started: bool) -> None:
+        """Release a caller registered with ``enter_lane``."""
+        with self._cond:
+            metrics = self._metrics[lane]
+            if started:
+                metrics.busy -= 1
+            else:
+                metrics.backlog -= 1
+            remaining = self._outstanding.get((lane, tenant), 0) - 1
+            if remaining > 0:
+                self._outstanding[(lane, tenant)] = remaining
+            else:
+                self._outstanding.pop((lane, tenant), None)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return a JSON-serialisable snapshot of queue depth and wait-time metrics."""
+        with self._cond:
+            return {
+                "running": self._running,
+                "in_flight": len(self._running_calls) + len(self._queued),
+                "max_concurrency": self.max_concurrency,
+                "tenants": len(self._tenant_buckets),
+                "lanes": {
+                    lane: self._metrics[lane].snapshot(len(self._queues[lane])) for lane in LANES
+                },
+            }
+
+
+_scheduler: Optional[VertexScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> VertexScheduler:
+    """Return the process-wide scheduler, configured from the environment on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            env = os.environ.get
+            workers = {
+                INTERACTIVE: max(1, int(env("VERTEX_INTERACTIVE_WORKERS", "32"))),
+                BULK: max(1, int(env("VERTEX_BULK_WORKERS", "4"))),
+            }
+            _scheduler = VertexScheduler(
+                max_concurrency=int(env("VERTEX_MAX_CONCURRENCY", "8")),
+                interactive_reserved=int(env("VERTEX_INTERACTIVE_RESERVED", "2")),
+                tenant_rate=float(env("VERTEX_TENANT_RATE", "10")),
+                tenant_burst=float(env("VERTEX_TENANT_BURST", "32")),
+                model_rate=float(env("VERTEX_MODEL_RATE", "50")),
+                model_burst=float(env("VERTEX_MODEL_BURST", "100")),
+                queue_limits={
+                    INTERACTIVE: int(env("VERTEX_INTERACTIVE_QUEUE_LIMIT", "100")),
+                    BULK: int(env("VERTEX_BULK_QUEUE_LIMIT", "1000")),
+                },
+                max_wait={
+                    INTERACTIVE: float(env("VERTEX_INTERACTIVE_MAX_WAIT", "30")),
+                    BULK: float(env("VERTEX_BULK_MAX_WAIT", "300")),
+                },
+                workers=workers,
+                tenant_queue_limit=int(env("VERTEX_TENANT_QUEUE_LIMIT", "8")),
+            )
+        return _scheduler
+
+
+def _parse_tenant_api_keys(raw: str) -> Dict[str, str]:
+    keys = {}
+    for entry in raw.split(","):
+        key, sep, tenant = entry.strip().partition("=")
+        if sep and key and tenant:
+            keys[key] = tenant
+    return keys
+
+
+def tenant_key(api_key: Optional[str] = None, client_host: Optional[str] = None) -> str:
+    """Derive the rate-limit key for a caller from what the server can trust.
+
+    An ``X-API-Key`` only counts when it is listed in ``VERTEX_TENANT_API_KEYS``
+    (``key=tenant,...``); any other caller is limited by its client address, so
+    rotating headers does not buy a fresh bucket.
+    """
+    if api_key:
+        tenant = _parse_tenant_api_keys(os.environ.get("VERTEX_TENANT_API_KEYS", "")).get(api_key)
+        if tenant:
+            return f"tenant:{tenant}"
+    return f"client:{client_host or 'unknown'}"
+
+
+def request_key(kind: str, **params: Any) -> str:
+    """Stable coalescing key for an upstream request."""
+    raw = json.dumps({"kind": kind, **params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -3,7 +3,7 @@
 from __future__ import annotations
 import json
 import os
-from typing import List
+from typing import Any, List, Optional
 import google.auth
 import google.auth.transport.requests
 from google.auth import default
@@ -11,6 +11,8 @@ import requests
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
 
+from .scheduler import INTERACTIVE, get_scheduler, request_key
+
 def get_google_credentials(scopes=None):
     """
     Retrieve Google Cloud credentials.
@@ -152,4 +154,48 @@ def call_vertex_text_generation(
         last_sentence = full_response.split('.')[-1]
         full_response = full_response[:-(len(last_sentence))]
     
-    return full_response or "Response was empty. Please try again."
\ No newline at end of file
+    return full_response or "Response was empty. Please try again."
+
+
+def scheduled_vertex_embeddings(
+    project: str,
+    location: str,
+    model: str,
+    texts: List[str],
+    tenant: Optional[str] = None,
+    lane: str = INTERACTIVE,
+) -> List[List[float]]:
+    """``call_vertex_embeddings`` routed through the scheduler, charged per instance."""
+    key = request_key("embeddings", project=project, location=location, model=model, texts=texts)
+    return get_scheduler().submit(
+        key,
+        lambda: call_vertex_embeddings(project=project, location=location, model=model, texts=texts),
+        tenant=tenant,
+        model=model,
+        lane=lane,
+        cost=len(texts),
+    )
+
+
+def scheduled_vertex_text_generation(
+    project: str,
+    location: str,
+    model: str,
+    prompt: str,
+    tenant: Optional[str] = None,
+    lane: str = INTERACTIVE,
+    **kwargs: Any,
+) -> str:
+    """``call_vertex_text_generation`` routed through the scheduler."""
+    key = request_key(
+        "generation", project=project, location=location, model=model, prompt=prompt, **kwargs
+    )
+    return get_scheduler().submit(
+        key,
+        lambda: call_vertex_text_generation(
+            project=project, location=location, model=model, prompt=prompt, **kwargs
+        ),
+        tenant=tenant,
+        model=model,
+        lane=lane,
+    )
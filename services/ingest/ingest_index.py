@@ -8,7 +8,7 @@ Ingest pipeline:
 
 import os
 import uuid
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import numpy as np
 import logging
@@ -18,7 +18,8 @@ from pdfminer.high_level import extract_text as extract_pdf_text
 from PyPDF2 import PdfReader
 from dotenv import load_dotenv, find_dotenv
 
-from ..common.vertex import call_vertex_embeddings
+from ..common.scheduler import BULK
+from ..common.vertex import scheduled_vertex_embeddings
 
 
 load_dotenv(find_dotenv(), override=False)
@@ -36,6 +37,7 @@ VERTEX_EMBEDDING_MODEL = os.environ.get(
     "VERTEX_EMBEDDING_MODEL", " << REPLACE_WITH_MODEL >> "
 )  # e.g. "textembedding-gecko"
 VERTEX_EMBEDDING_DIMS = int(os.environ.get("VERTEX_EMBEDDING_DIMS", "768"))
+VERTEX_EMBEDDING_BATCH_SIZE = max(1, int(os.environ.get("VERTEX_EMBEDDING_BATCH_SIZE", "16")))
 # -------------------------
 
 logger = logging.getLogger(__name__)
@@ -80,18 +82,26 @@ def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str
     return chunks
 
 
-def get_vertex_embeddings(texts: List[str]) -> List[List[float]]:
-    """Fetch embeddings for the provided texts using Vertex AI."""
-    if not texts:
-        return []
-
-    embeddings = call_vertex_embeddings(
-        project=VERTEX_PROJECT,
-        location=VERTEX_LOCATION,
-        model=VERTEX_EMBEDDING_MODEL,
-        texts=texts,
-    )
+def get_vertex_embeddings(texts: List[str], tenant: Optional[str] = None) -> List[List[float]]:
+    """Fetch embeddings for the provided texts using Vertex AI (bulk lane).
+
+    Texts are sent in batches so each upstream call is rate limited on its own.
+    """
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), VERTEX_EMBEDDING_BATCH_SIZE):
+        embeddings.extend(
+            scheduled_vertex_embeddings(
+                project=VERTEX_PROJECT,
+                location=VERTEX_LOCATION,
+                model=VERTEX_EMBEDDING_MODEL,
+                texts=texts[start : start + VERTEX_EMBEDDING_BATCH_SIZE],
+                tenant=tenant,
+                lane=BULK,
+            )
+        )
     return embeddings
+
+
 def ensure_index():
     recreate = False
     if es.indices.exists(index=INDEX_NAME):
@@ -136,7 +146,9 @@ def ensure_index():
         es.indices.create(index=INDEX_NAME, body=mapping)
 
 
-def index_document(file_path: str, title: str, metadata: Dict[str, str]):
+def index_document(
+    file_path: str, title: str, metadata: Dict[str, str], tenant: Optional[str] = None
+):
     ensure_index()
     text = ""
     if file_path.lower().endswith(".pdf"):
@@ -153,7 +165,7 @@ def index_document(file_path: str, title: str, metadata: Dict[str, str]):
     chunks = chunk_text(text)
     if not chunks:
         raise ValueError("Document contains no extractable text")
-    embeddings = get_vertex_embeddings(chunks)
+    embeddings = get_vertex_embeddings(chunks, tenant=tenant)
 
     if len(embeddings) != len(chunks):
         raise RuntimeError(
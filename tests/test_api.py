@@ -0,0 +1,101 @@
+import os
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services.api import search_rag
+from services.common.scheduler import BULK, INTERACTIVE, SchedulerRejected, VertexScheduler
+from services.ingest import ingest_index
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = VertexScheduler(tenant_rate=0, model_rate=0)
+    monkeypatch.setattr(search_rag, "get_scheduler", lambda: scheduler)
+    monkeypatch.setattr(search_rag, "_lane_limiters", {})
+    return scheduler
+
+
+@pytest.fixture
+def client(scheduler):
+    return TestClient(search_rag.app)
+
+
+def test_query_rejection_maps_to_429_with_retry_after(client, monkeypatch):
+    def reject(**kwargs):
+        raise SchedulerRejected("Vertex rate limit exceeded for this client", retry_after=7.4)
+
+    monkeypatch.setattr(search_rag, "_answer_query", reject)
+
+    response = client.post("/query", json={"query": "hello"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+    assert response.json()["detail"] == "Vertex rate limit exceeded for this client"
+
+
+def test_upload_rejection_removes_temp_file(client, monkeypatch):
+    seen = {}
+
+    def reject(file_path, **kwargs):
+        seen["path"] = file_path
+        assert os.path.exists(file_path)
+        raise SchedulerRejected("Vertex bulk queue is full", retry_after=3)
+
+    monkeypatch.setattr(search_rag, "index_document", reject)
+    filename = f"{uuid.uuid4()}.txt"
+
+    response = client.post("/upload", files={"file": (filename, b"some text", "text/plain")})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+    assert not os.path.exists(seen["path"])
+
+
+def test_full_lane_backlog_is_rejected_before_running(client, scheduler, monkeypatch):
+    scheduler.workers[INTERACTIVE] = 1
+    scheduler.queue_limits[INTERACTIVE] = 1
+    scheduler.enter_lane(INTERACTIVE, "client:other-1")
+    scheduler.enter_lane(INTERACTIVE, "client:other-2")
+    calls = []
+    monkeypatch.setattr(search_rag, "_answer_query", lambda **kwargs: calls.append(kwargs))
+
+    response = client.post("/query", json={"query": "hello"})
+
+    assert response.status_code == 429
+    assert calls == []
+    assert scheduler.metrics()["lanes"][INTERACTIVE]["rejected"] == 1
+
+
+def test_scheduler_metrics_include_worker_wait(client, monkeypatch):
+    monkeypatch.setattr(
+        search_rag, "_answer_query", lambda tenant, **kwargs: {"answer": tenant, "sources": []}
+    )
+
+    response = client.post("/query", json={"query": "hello"})
+    assert response.status_code == 200
+    assert response.json()["answer"].startswith("client:")
+
+    lane = client.get("/metrics/scheduler").json()["lanes"][INTERACTIVE]
+    assert lane["queue_depth"] == 0
+    assert lane["waiting_for_worker"] == 0
+    assert lane["worker_wait_seconds"]["max"] >= 0
+    assert lane["rejected"] == 0
+
+
+def test_get_vertex_embeddings_sends_batches_in_bulk_lane(monkeypatch):
+    batches = []
+
+    def fake_embeddings(texts, tenant, lane, **kwargs):
+        batches.append((list(texts), tenant, lane))
+        return [[float(len(t))] for t in texts]
+
+    monkeypatch.setattr(ingest_index, "scheduled_vertex_embeddings", fake_embeddings)
+    monkeypatch.setattr(ingest_index, "VERTEX_EMBEDDING_BATCH_SIZE", 2)
+
+    embeddings = ingest_index.get_vertex_embeddings(["a", "bb", "ccc", "dddd", "e"], tenant="t")
+
+    assert [texts for texts, _, _ in batches] == [["a", "bb"], ["ccc", "dddd"], ["e"]]
+    assert {(tenant, lane) for _, tenant, lane in batches} == {("t", BULK)}
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0], [1.0]]
@@ -0,0 +1,295 @@
+import threading
+import time
+
+import pytest
+
+from services.common.scheduler import (
+    BULK,
+    INTERACTIVE,
+    SchedulerRejected,
+    TokenBucket,
+    VertexScheduler,
+    tenant_key,
+)
+
+
+class Call(threading.Thread):
+    """Run ``scheduler.submit`` in a thread and keep its outcome."""
+
+    def __init__(self, scheduler, key, fn, **kwargs):
+        super().__init__(daemon=True)
+        self.scheduler, self.key, self.fn, self.kwargs = scheduler, key, fn, kwargs
+        self.result = self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.scheduler.submit(self.key, self.fn, **self.kwargs)
+        except BaseException as exc:
+            self.error = exc
+
+
+def unlimited(**kwargs):
+    return VertexScheduler(tenant_rate=0, model_rate=0, **kwargs)
+
+
+def blocker(gate, started=None):
+    def fn():
+        if started is not None:
+            started.set()
+        gate.wait(5)
+        return "done"
+
+    return fn
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_identical_in_flight_requests_share_one_call():
+    scheduler = unlimited()
+    gate, started, calls = threading.Event(), threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        return blocker(gate, started)()
+
+    leader = Call(scheduler, "same", fn)
+    started.wait(2)
+    followers = [Call(scheduler, "same", fn) for _ in range(4)]
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["coalesced"] == 4)
+    gate.set()
+    for call in [leader, *followers]:
+        call.join(2)
+
+    assert len(calls) == 1
+    assert [c.result for c in [leader, *followers]] == ["done"] * 5
+
+
+def test_followers_are_released_when_leader_raises_base_exception():
+    class Abort(BaseException):
+        pass
+
+    scheduler = unlimited()
+    gate, started = threading.Event(), threading.Event()
+
+    def fn():
+        started.set()
+        gate.wait(5)
+        raise Abort()
+
+    leader = Call(scheduler, "same", fn)
+    started.wait(2)
+    follower = Call(scheduler, "same", fn)
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["coalesced"] == 1)
+    gate.set()
+    leader.join(2)
+    follower.join(2)
+
+    assert not follower.is_alive()
+    assert isinstance(leader.error, Abort)
+    assert isinstance(follower.error, Abort)
+
+
+def test_interactive_is_admitted_before_bulk():
+    scheduler = unlimited(max_concurrency=1, interactive_reserved=0)
+    gate, started, order = threading.Event(), threading.Event(), []
+    running = Call(scheduler, "running", blocker(gate, started))
+    started.wait(2)
+
+    bulk = Call(scheduler, "bulk", lambda: order.append("bulk"), lane=BULK)
+    wait_for(lambda: scheduler.metrics()["lanes"][BULK]["queue_depth"] == 1)
+    interactive = Call(scheduler, "interactive", lambda: order.append("interactive"))
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["queue_depth"] == 1)
+    gate.set()
+    for call in (running, bulk, interactive):
+        call.join(2)
+
+    assert order == ["interactive", "bulk"]
+
+
+def test_bulk_cannot_take_reserved_slots():
+    scheduler = unlimited(max_concurrency=2, interactive_reserved=1)
+    gate, started = threading.Event(), threading.Event()
+    first_bulk = Call(scheduler, "bulk-1", blocker(gate, started), lane=BULK)
+    started.wait(2)
+
+    second_bulk = Call(scheduler, "bulk-2", lambda: "bulk", lane=BULK)
+    wait_for(lambda: scheduler.metrics()["lanes"][BULK]["queue_depth"] == 1)
+    assert scheduler.submit("query", lambda: "query") == "query"
+    assert second_bulk.is_alive()
+
+    gate.set()
+    first_bulk.join(2)
+    second_bulk.join(2)
+    assert second_bulk.result == "bulk"
+
+
+def test_tenants_are_limited_independently_and_charged_by_cost():
+    scheduler = VertexScheduler(tenant_rate=0.1, tenant_burst=10, model_rate=0, max_wait={INTERACTIVE: 0.2})
+
+    assert scheduler.submit("a", lambda: 1, tenant="t1", cost=6) == 1
+    with pytest.raises(SchedulerRejected):
+        scheduler.submit("b", lambda: 1, tenant="t1", cost=6)
+    assert scheduler.submit("c", lambda: 1, tenant="t2", cost=6) == 1
+    assert scheduler.metrics()["lanes"][INTERACTIVE]["rejected"] == 1
+
+
+def test_timeout_retry_after_uses_own_buckets():
+    scheduler = VertexScheduler(tenant_rate=0.1, tenant_burst=1, model_rate=0, max_wait={INTERACTIVE: 0.2})
+    scheduler.submit("a", lambda: 1, tenant="slow")
+
+    with pytest.raises(SchedulerRejected) as excinfo:
+        scheduler.submit("b", lambda: 1, tenant="slow")
+
+    # One token at 0.1/s is roughly ten seconds away.
+    assert 9 < excinfo.value.retry_after <= 10
+
+
+def test_queue_limit_rejects_new_requests():
+    scheduler = unlimited(max_concurrency=1, queue_limits={INTERACTIVE: 1})
+    gate, started = threading.Event(), threading.Event()
+    running = Call(scheduler, "running", blocker(gate, started))
+    started.wait(2)
+    queued = Call(scheduler, "queued", lambda: 1)
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["queue_depth"] == 1)
+
+    with pytest.raises(SchedulerRejected):
+        scheduler.submit("extra", lambda: 1)
+
+    gate.set()
+    running.join(2)
+    queued.join(2)
+
+
+def test_promotion_keeps_leader_deadline_and_follower_times_out_on_its_own():
+    scheduler = unlimited(
+        max_concurrency=1, interactive_reserved=0, max_wait={INTERACTIVE: 0.3, BULK: 300}
+    )
+    gate, started = threading.Event(), threading.Event()
+    running = Call(scheduler, "running", blocker(gate, started))
+    started.wait(2)
+    bulk = Call(scheduler, "shared", lambda: 1, lane=BULK)
+    wait_for(lambda: scheduler.metrics()["lanes"][BULK]["queue_depth"] == 1)
+
+    began = time.monotonic()
+    follower = Call(scheduler, "shared", lambda: 1)
+    follower.join(2)
+
+    assert isinstance(follower.error, SchedulerRejected)
+    assert time.monotonic() - began < 1.5
+    assert bulk.is_alive()
+
+    gate.set()
+    running.join(2)
+    bulk.join(2)
+    assert bulk.result == 1
+
+
+def test_follower_joins_without_promotion_when_interactive_queue_is_full():
+    scheduler = unlimited(max_concurrency=1, interactive_reserved=0, queue_limits={INTERACTIVE: 1})
+    gate, started = threading.Event(), threading.Event()
+    running = Call(scheduler, "running", blocker(gate, started))
+    started.wait(2)
+    queued = Call(scheduler, "queued", lambda: 1)
+    bulk = Call(scheduler, "shared", lambda: 1, lane=BULK)
+    wait_for(lambda: scheduler.metrics()["lanes"][BULK]["queue_depth"] == 1)
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["queue_depth"] == 1)
+
+    follower = Call(scheduler, "shared", lambda: 1)
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["coalesced"] == 1)
+    assert scheduler.metrics()["lanes"][BULK]["queue_depth"] == 1
+
+    gate.set()
+    for call in (running, queued, bulk, follower):
+        call.join(2)
+    assert follower.result == 1
+
+
+def test_tenant_with_empty_bucket_cannot_fill_the_lane():
+    scheduler = VertexScheduler(
+        tenant_rate=0.5, tenant_burst=1, model_rate=0, max_wait={INTERACTIVE: 5}, tenant_queue_limit=2
+    )
+    scheduler.submit("a-0", lambda: 1, tenant="a")
+    flood = [Call(scheduler, f"a-{i}", lambda: 1, tenant="a") for i in range(1, 20)]
+    wait_for(lambda: sum(not c.is_alive() for c in flood) >= 17)
+
+    assert scheduler.metrics()["lanes"][INTERACTIVE]["waiting_for_admission"] <= 2
+    began = time.monotonic()
+    assert scheduler.submit("b-0", lambda: "b", tenant="b") == "b"
+    assert time.monotonic() - began < 0.5
+    assert all(isinstance(c.error, SchedulerRejected) for c in flood if not c.is_alive())
+
+
+def test_follower_does_not_wait_on_another_tenants_bucket():
+    scheduler = VertexScheduler(tenant_rate=0.5, tenant_burst=1, model_rate=0, max_wait={INTERACTIVE: 5})
+    scheduler.submit("warm-up", lambda: 1, tenant="a")
+    gate, calls = threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        gate.wait(5)
+        return "answer"
+
+    slow = Call(scheduler, "same", fn, tenant="a")
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["waiting_for_admission"] == 1)
+    fresh = Call(scheduler, "same", fn, tenant="b")
+    wait_for(lambda: len(calls) == 1)
+    wait_for(lambda: scheduler.metrics()["lanes"][INTERACTIVE]["coalesced"] == 1)
+    gate.set()
+    fresh.join(2)
+    slow.join(2)
+
+    assert fresh.result == slow.result == "answer"
+    assert len(calls) == 1
+
+
+def test_lane_backlog_is_bounded_and_reported():
+    scheduler = unlimited(workers={INTERACTIVE: 1}, queue_limits={INTERACTIVE: 1}, tenant_queue_limit=2)
+
+    queued_at = scheduler.enter_lane(INTERACTIVE, "a")
+    scheduler.enter_lane(INTERACTIVE, "b")
+    with pytest.raises(SchedulerRejected):
+        scheduler.enter_lane(INTERACTIVE, "c")
+    lane = scheduler.metrics()["lanes"][INTERACTIVE]
+    assert lane["waiting_for_worker"] == 2
+    assert lane["queue_depth"] == 2
+    assert lane["rejected"] == 1
+
+    scheduler.worker_started(INTERACTIVE, time.monotonic() - queued_at)
+    scheduler.leave_lane(INTERACTIVE, "a", started=True)
+    scheduler.leave_lane(INTERACTIVE, "b", started=False)
+    lane = scheduler.metrics()["lanes"][INTERACTIVE]
+    assert lane["queue_depth"] == 0
+    assert lane["worker_wait_seconds"]["max"] >= 0
+
+
+def test_lane_limits_requests_per_tenant():
+    scheduler = unlimited(tenant_queue_limit=1)
+
+    scheduler.enter_lane(INTERACTIVE, "a")
+    with pytest.raises(SchedulerRejected):
+        scheduler.enter_lane(INTERACTIVE, "a")
+    scheduler.enter_lane(INTERACTIVE, "b")
+
+
+def test_token_bucket_admits_oversized_cost_when_full():
+    bucket = TokenBucket(rate=1, capacity=4)
+    now = bucket.updated
+
+    assert bucket.delay(now, cost=10) == 0
+    bucket.take(10)
+    assert bucket.delay(now, cost=1) == pytest.approx(7)
+    assert bucket.delay(now + 7, cost=1, reserve=2) == pytest.approx(2)
+
+
+def test_tenant_key_only_trusts_configured_api_keys(monkeypatch):
+    monkeypatch.setenv("VERTEX_TENANT_API_KEYS", "secret=acme")
+
+    assert tenant_key(api_key="secret", client_host="10.0.0.1") == "tenant:acme"
+    assert tenant_key(api_key="made-up", client_host="10.0.0.1") == "client:10.0.0.1"
+    assert tenant_key(client_host="10.0.0.2") == "client:10.0.0.2"